@@ -4,18 +4,31 @@ Sistema Web de Control de Stock y Registro Financiero
 Flask + SQLite + Bootstrap (Responsive para móvil)
 """
 
-from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, send_file
+from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, send_from_directory, Response
 import sqlite3
-from datetime import datetime, timedelta
-import csv
+from datetime import datetime, date, timedelta
 import os
-import io
+import math
+import threading
+import time
 from contextlib import contextmanager
+from functools import lru_cache
 
 app = Flask(__name__)
 app.secret_key = 'tu_clave_secreta_aqui'  # Cambia esto en producción
 
 DB_FILE = "stock_finanzas.db"
+# Columnas que envía el formulario de edición, en el orden de _UPDATE_PRODUCTO_SQL
+PRODUCTO_COLUMNAS = ('codigo', 'nombre', 'categoria', 'precio_compra', 'precio_venta',
+                     'margen_ganancia', 'stock_actual', 'stock_minimo')
+_UPDATE_PRODUCTO_SQL = f"UPDATE productos SET {', '.join(f'{k}=?' for k in PRODUCTO_COLUMNAS)} WHERE id=?"
+
+PAGINA = 50  # filas por página en /productos y /movimientos
+PAGINA_MAX = 200  # tope para ?limit=
+PRODUCTOS_CACHE_TTL = 5  # segundos
+PWA_MAX_AGE = 86400  # caché del navegador para manifest.json y sw.js
+TIPOS_MOVIMIENTO = {'entrada': 'Entrada', 'salida': 'Salida', 'ajuste': 'Ajuste'}
+BULK_CHUNK = 200  # productos por UPDATE ... CASE, bajo el límite de 999 parámetros de SQLite
 
 # --------------------
 # Utilidades
@@ -35,19 +48,35 @@ class DB:
     def __init__(self, dbfile=DB_FILE):
         ensure_db_folder()
         self.dbfile = dbfile
+        # Una conexión por hilo: con WAL las lecturas de distintos hilos corren en paralelo.
+        # El lock solo serializa las escrituras de varias sentencias dentro del proceso.
+        self._local = threading.local()
+        self._lock = threading.RLock()
+        # Caché de listar_productos por texto de búsqueda: {search: (expira, filas)}
+        self._productos_cache = {}
+        self._productos_version = 0
         self.init_db()
 
+    def _conectar(self):
+        # isolation_level=None: cada sentencia suelta se confirma sola y las escrituras
+        # de varias sentencias abren su propia transacción con BEGIN IMMEDIATE
+        conn = sqlite3.connect(self.dbfile, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        conn.execute('PRAGMA cache_size=-20000')
+        return conn
+
     @contextmanager
     def get_connection(self):
-        conn = sqlite3.connect(self.dbfile)
-        conn.row_factory = sqlite3.Row
-        try:
-            yield conn
-        finally:
-            conn.close()
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = self._conectar()
+        yield conn
 
     def init_db(self):
         with self.get_connection() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
             c = conn.cursor()
             c.execute('''
                 CREATE TABLE IF NOT EXISTS productos (
@@ -95,7 +124,99 @@ class DB:
                     creado_en TEXT
                 )
             ''')
-            conn.commit()
+            c.execute('CREATE INDEX IF NOT EXISTS idx_mov_fecha ON movimientos(fecha)')
+            c.execute('CREATE INDEX IF NOT EXISTS idx_mov_prod ON movimientos(producto_id)')
+            c.execute('CREATE INDEX IF NOT EXISTS idx_fin_fecha ON finanzas(fecha)')
+            c.execute('CREATE INDEX IF NOT EXISTS idx_prod_nombre ON productos(nombre)')
+
+            # Saldo acumulado de finanzas, mantenido por triggers para que balance_total sea O(1)
+            # Tabla, carga inicial y triggers en una sola transacción: con varios procesos
+            # arrancando a la vez, ninguno puede cargar dos veces ni insertar finanzas sin trigger
+            c.execute('BEGIN IMMEDIATE')
+            try:
+                existe = c.execute("SELECT 1 FROM sqlite_master WHERE name='balance_cache'").fetchone()
+                c.execute('''
+                    CREATE TABLE IF NOT EXISTS balance_cache (
+                        id INTEGER PRIMARY KEY CHECK (id = 1),
+                        ingresos_ventas REAL DEFAULT 0,
+                        ganancias_netas REAL DEFAULT 0,
+                        otros_ingresos REAL DEFAULT 0,
+                        egresos REAL DEFAULT 0
+                    )
+                ''')
+                if not existe:
+                    c.execute('''
+                        INSERT OR IGNORE INTO balance_cache (id, ingresos_ventas, ganancias_netas, otros_ingresos, egresos)
+                        SELECT 1,
+                            COALESCE((SELECT SUM(monto) FROM finanzas WHERE tipo='Ingreso' AND categoria='Ingresos'), 0),
+                            COALESCE((SELECT SUM(monto) FROM finanzas WHERE tipo='Ingreso' AND categoria='Ganancias'), 0),
+                            COALESCE((SELECT SUM(monto) FROM finanzas WHERE tipo='Ingreso' AND categoria NOT IN ('Ingresos', 'Ganancias')), 0),
+                            COALESCE((SELECT SUM(monto) FROM finanzas WHERE tipo='Egreso'), 0)
+                    ''')
+
+                def ajuste_balance(fila, signo):
+                    return f'''
+                        UPDATE balance_cache SET
+                            ingresos_ventas = ingresos_ventas {signo} CASE WHEN {fila}.tipo='Ingreso' AND {fila}.categoria='Ingresos' THEN COALESCE({fila}.monto, 0) ELSE 0 END,
+                            ganancias_netas = ganancias_netas {signo} CASE WHEN {fila}.tipo='Ingreso' AND {fila}.categoria='Ganancias' THEN COALESCE({fila}.monto, 0) ELSE 0 END,
+                            otros_ingresos = otros_ingresos {signo} CASE WHEN {fila}.tipo='Ingreso' AND {fila}.categoria NOT IN ('Ingresos', 'Ganancias') THEN COALESCE({fila}.monto, 0) ELSE 0 END,
+                            egresos = egresos {signo} CASE WHEN {fila}.tipo='Egreso' THEN COALESCE({fila}.monto, 0) ELSE 0 END
+                        WHERE id = 1;
+                    '''
+                c.execute(f'CREATE TRIGGER IF NOT EXISTS finanzas_balance_ai AFTER INSERT ON finanzas BEGIN {ajuste_balance("new", "+")} END')
+                c.execute(f'CREATE TRIGGER IF NOT EXISTS finanzas_balance_ad AFTER DELETE ON finanzas BEGIN {ajuste_balance("old", "-")} END')
+                c.execute(f'''CREATE TRIGGER IF NOT EXISTS finanzas_balance_au AFTER UPDATE OF tipo, categoria, monto ON finanzas BEGIN
+                    {ajuste_balance("old", "-")} {ajuste_balance("new", "+")} END''')
+            except Exception:
+                c.execute('ROLLBACK')
+                raise
+            c.execute('COMMIT')
+
+            # Índice de trigramas para la búsqueda de productos (si SQLite trae FTS5 con trigram).
+            # Tabla, triggers y carga inicial van en una transacción para que ningún producto
+            # insertado por otro proceso quede fuera del índice.
+            c.execute('BEGIN IMMEDIATE')
+            try:
+                existe = c.execute("SELECT 1 FROM sqlite_master WHERE name='productos_fts'").fetchone()
+                try:
+                    c.execute('''
+                        CREATE VIRTUAL TABLE IF NOT EXISTS productos_fts USING fts5(
+                            nombre, codigo, categoria,
+                            content='productos', content_rowid='id',
+                            tokenize='trigram'
+                        )
+                    ''')
+                    self._fts = True
+                except sqlite3.OperationalError:
+                    self._fts = False
+                if self._fts:
+                    c.execute('''
+                        CREATE TRIGGER IF NOT EXISTS productos_fts_ai AFTER INSERT ON productos BEGIN
+                            INSERT INTO productos_fts(rowid, nombre, codigo, categoria)
+                            VALUES (new.id, new.nombre, new.codigo, new.categoria);
+                        END
+                    ''')
+                    c.execute('''
+                        CREATE TRIGGER IF NOT EXISTS productos_fts_ad AFTER DELETE ON productos BEGIN
+                            INSERT INTO productos_fts(productos_fts, rowid, nombre, codigo, categoria)
+                            VALUES ('delete', old.id, old.nombre, old.codigo, old.categoria);
+                        END
+                    ''')
+                    c.execute('''
+                        CREATE TRIGGER IF NOT EXISTS productos_fts_au AFTER UPDATE OF nombre, codigo, categoria ON productos BEGIN
+                            INSERT INTO productos_fts(productos_fts, rowid, nombre, codigo, categoria)
+                            VALUES ('delete', old.id, old.nombre, old.codigo, old.categoria);
+                            INSERT INTO productos_fts(rowid, nombre, codigo, categoria)
+                            VALUES (new.id, new.nombre, new.codigo, new.categoria);
+                        END
+                    ''')
+                    if not existe:
+                        # Indexar los productos que ya existían antes de crear la tabla
+                        c.execute("INSERT INTO productos_fts(productos_fts) VALUES ('rebuild')")
+            except Exception:
+                c.execute('ROLLBACK')
+                raise
+            c.execute('COMMIT')
 
     def add_producto(self, codigo, nombre, categoria, precio_compra, precio_venta, margen_ganancia, stock_inicial, stock_minimo):
         with self.get_connection() as conn:
@@ -103,18 +224,85 @@ class DB:
                 INSERT INTO productos (codigo,nombre,categoria,precio_compra,precio_venta,margen_ganancia,stock_actual,stock_minimo,creado_en)
                 VALUES (?,?,?,?,?,?,?,?,?)
             ''', (codigo, nombre, categoria, precio_compra, precio_venta, margen_ganancia, stock_inicial, stock_minimo, now_iso()))
-            conn.commit()
+            self._invalidar_productos()
             return cur.lastrowid
 
-    def listar_productos(self, search=None):
+    def _invalidar_productos(self):
+        self._productos_version += 1
+        self._productos_cache.clear()
+
+    @property
+    def productos_version(self):
+        """Cambia cada vez que se modifica la tabla de productos"""
+        return self._productos_version
+
+    def listar_productos(self, search=None, after=None, limit=None, cache=True):
+        """Productos ordenados por nombre.
+
+        after: (nombre, id) de la última fila de la página anterior (paginación por clave).
+        cache=False consulta siempre la base (para quien ya guarda su propio resultado).
+        """
+        key = (search, after, limit)
         with self.get_connection() as conn:
-            c = conn.cursor()
-            if search:
-                q = f"%{search}%"
-                c.execute('SELECT * FROM productos WHERE nombre LIKE ? OR codigo LIKE ? OR categoria LIKE ? ORDER BY nombre', (q, q, q))
-            else:
-                c.execute('SELECT * FROM productos ORDER BY nombre')
-            return c.fetchall()
+            if not cache:
+                return self._listar_productos(conn, search, after, limit)
+            cached = self._productos_cache.get(key)
+            if cached and cached[0] > time.monotonic():
+                return cached[1]
+            rows = self._listar_productos(conn, search, after, limit)
+            if len(self._productos_cache) >= 64:
+                self._productos_cache.clear()
+            self._productos_cache[key] = (time.monotonic() + PRODUCTOS_CACHE_TTL, rows)
+            return rows
+
+    def _filtro_productos(self, search):
+        """JOIN, condiciones y parámetros para filtrar productos por texto de búsqueda"""
+        join = ''
+        where = []
+        params = []
+        if search and not search.strip():
+            search = None
+        if search and self._fts and len(search) >= 3:
+            # Con trigramas, una frase entre comillas coincide como subcadena en cualquier
+            # columna, igual que LIKE '%...%'. Con menos de 3 caracteres no hay trigramas.
+            join = ' JOIN productos_fts f ON f.rowid = p.id'
+            where.append('productos_fts MATCH ?')
+            params.append('"%s"' % search.replace('"', '""'))
+        elif search:
+            q = f"%{search}%"
+            where.append('(p.nombre LIKE ? OR p.codigo LIKE ? OR p.categoria LIKE ?)')
+            params.extend((q, q, q))
+        return join, where, params
+
+    def _listar_productos(self, conn, search, after, limit):
+        c = conn.cursor()
+        join, where, params = self._filtro_productos(search)
+        sql = 'SELECT p.* FROM productos p' + join
+        if after:
+            where.append('(p.nombre, p.id) > (?, ?)')
+            params.extend(after)
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        sql += ' ORDER BY p.nombre, p.id'
+        if limit:
+            sql += ' LIMIT ?'
+            params.append(int(limit))
+        c.execute(sql, params)
+        return c.fetchall()
+
+    def resumen_productos(self, search=None):
+        """Totales de stock de todos los productos que coinciden con la búsqueda (no solo de una página)"""
+        join, where, params = self._filtro_productos(search)
+        sql = '''SELECT COUNT(*) as total,
+                        SUM(CASE WHEN p.stock_actual = 0 THEN 1 ELSE 0 END) as sin_stock,
+                        SUM(CASE WHEN p.stock_actual <= p.stock_minimo THEN 1 ELSE 0 END) as stock_bajo,
+                        SUM(CASE WHEN p.stock_actual > p.stock_minimo THEN 1 ELSE 0 END) as stock_ok
+                 FROM productos p''' + join
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        with self.get_connection() as conn:
+            r = conn.execute(sql, params).fetchone()
+            return {k: r[k] or 0 for k in ('total', 'sin_stock', 'stock_bajo', 'stock_ok')}
 
     def get_producto(self, producto_id):
         with self.get_connection() as conn:
@@ -125,6 +313,17 @@ class DB:
     def update_producto(self, producto_id, **kwargs):
         if not kwargs:
             return
+        if kwargs.keys() != set(PRODUCTO_COLUMNAS):
+            self._update_producto_partial(producto_id, **kwargs)
+            return
+        # Sentencia fija: sqlite3 la reutiliza desde su caché de sentencias preparadas
+        vals = [kwargs[k] for k in PRODUCTO_COLUMNAS]
+        vals.append(producto_id)
+        with self.get_connection() as conn:
+            conn.execute(_UPDATE_PRODUCTO_SQL, vals)
+            self._invalidar_productos()
+
+    def _update_producto_partial(self, producto_id, **kwargs):
         keys = []
         vals = []
         for k, v in kwargs.items():
@@ -134,121 +333,252 @@ class DB:
         sql = f"UPDATE productos SET {', '.join(keys)} WHERE id=?"
         with self.get_connection() as conn:
             conn.execute(sql, vals)
-            conn.commit()
+            self._invalidar_productos()
 
     def delete_producto(self, producto_id):
-        with self.get_connection() as conn:
-            conn.execute('DELETE FROM productos WHERE id=?', (producto_id,))
-            conn.execute('DELETE FROM movimientos WHERE producto_id=?', (producto_id,))
-            conn.commit()
+        with self._lock, self.get_connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                conn.execute('DELETE FROM productos WHERE id=?', (producto_id,))
+                conn.execute('DELETE FROM movimientos WHERE producto_id=?', (producto_id,))
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+            conn.execute('COMMIT')
+            self._invalidar_productos()
 
     def add_movimiento(self, producto_id, tipo, cantidad, comentario, usuario, fecha=None, link_finanza=True):
+        ts = now_iso()
         if fecha is None:
-            fecha = now_iso()
-        with self.get_connection() as conn:
-            cur = conn.execute('''
-                INSERT INTO movimientos (fecha,producto_id,tipo,cantidad,comentario,usuario,creado_en)
-                VALUES (?,?,?,?,?,?,?)
-            ''', (fecha, producto_id, tipo, cantidad, comentario, usuario, now_iso()))
-            mid = cur.lastrowid
-            
-            # Actualizar stock
-            if tipo.lower() == 'entrada':
-                conn.execute('UPDATE productos SET stock_actual = stock_actual + ? WHERE id=?', (cantidad, producto_id))
-            elif tipo.lower() == 'salida':
-                conn.execute('UPDATE productos SET stock_actual = stock_actual - ? WHERE id=?', (cantidad, producto_id))
-            elif tipo.lower() == 'ajuste':
-                conn.execute('UPDATE productos SET stock_actual = ? WHERE id=?', (cantidad, producto_id))
-            
-            if link_finanza:
-                prod = self.get_producto(producto_id)
-                if prod:
-                    if tipo.lower() == 'salida':
-                        pv = prod['precio_venta'] or 0
-                        pc = prod['precio_compra'] or 0
-                        
-                        if pv > 0:
-                            ingreso_bruto = pv * cantidad
-                            concepto_ingreso = f"Venta: {prod['nombre']} x{cantidad} a ${pv:.2f} c/u"
-                            conn.execute('''
-                                INSERT INTO finanzas (fecha,tipo,monto,concepto,categoria,movimiento_id,creado_en) 
-                                VALUES (?,?,?,?,?,?,?)
-                            ''', (fecha, 'Ingreso', ingreso_bruto, concepto_ingreso, 'Ingresos', mid, now_iso()))
-                        
-                        if pv > pc:
-                            ganancia_neta = (pv - pc) * cantidad
-                            concepto_ganancia = f"Ganancia neta: {prod['nombre']} x{cantidad}"
-                            conn.execute('''
-                                INSERT INTO finanzas (fecha,tipo,monto,concepto,categoria,movimiento_id,creado_en) 
-                                VALUES (?,?,?,?,?,?,?)
-                            ''', (fecha, 'Ingreso', ganancia_neta, concepto_ganancia, 'Ganancias', mid, now_iso()))
-                    
-                    elif tipo.lower() == 'entrada':
-                        pc = prod['precio_compra'] or 0
-                        if pc > 0:
-                            monto_compra = pc * cantidad
-                            concepto_compra = f"Compra: {prod['nombre']} x{cantidad} a ${pc:.2f} c/u"
-                            conn.execute('''
-                                INSERT INTO finanzas (fecha,tipo,monto,concepto,categoria,movimiento_id,creado_en) 
-                                VALUES (?,?,?,?,?,?,?)
-                            ''', (fecha, 'Egreso', monto_compra, concepto_compra, 'Compras', mid, now_iso()))
-            
-            conn.commit()
+            fecha = ts
+        with self._lock, self.get_connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                mid = self._insert_movimiento(conn, producto_id, tipo, cantidad, comentario, usuario, fecha, link_finanza, ts)
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+            conn.execute('COMMIT')
+            self._invalidar_productos()
             return mid
 
-    def listar_movimientos(self, limit=None):
+    def _insert_movimiento(self, conn, producto_id, tipo, cantidad, comentario, usuario, fecha, link_finanza, ts):
+        # Se ejecuta dentro de la transacción abierta por add_movimiento
+        cur = conn.execute('''
+            INSERT INTO movimientos (fecha,producto_id,tipo,cantidad,comentario,usuario,creado_en)
+            VALUES (?,?,?,?,?,?,?)
+        ''', (fecha, producto_id, tipo, cantidad, comentario, usuario, ts))
+        mid = cur.lastrowid
+        
+        # Actualizar stock
+        if tipo.lower() == 'entrada':
+            conn.execute('UPDATE productos SET stock_actual = stock_actual + ? WHERE id=?', (cantidad, producto_id))
+        elif tipo.lower() == 'salida':
+            conn.execute('UPDATE productos SET stock_actual = stock_actual - ? WHERE id=?', (cantidad, producto_id))
+        elif tipo.lower() == 'ajuste':
+            conn.execute('UPDATE productos SET stock_actual = ? WHERE id=?', (cantidad, producto_id))
+        
+        if link_finanza:
+            prod = conn.execute('SELECT precio_venta, precio_compra, nombre FROM productos WHERE id=?', (producto_id,)).fetchone()
+            if prod:
+                conn.executemany('''
+                    INSERT INTO finanzas (fecha,tipo,monto,concepto,categoria,movimiento_id,creado_en) 
+                    VALUES (?,?,?,?,?,?,?)
+                ''', self._finanzas_de_movimiento(prod, tipo, cantidad, fecha, mid, ts))
+
+        return mid
+
+    def _finanzas_de_movimiento(self, prod, tipo, cantidad, fecha, mid, ts):
+        """Filas de finanzas generadas automáticamente por un movimiento"""
+        rows = []
+        if tipo.lower() == 'salida':
+            pv = prod['precio_venta'] or 0
+            pc = prod['precio_compra'] or 0
+            
+            if pv > 0:
+                ingreso_bruto = pv * cantidad
+                concepto_ingreso = f"Venta: {prod['nombre']} x{cantidad} a ${pv:.2f} c/u"
+                rows.append((fecha, 'Ingreso', ingreso_bruto, concepto_ingreso, 'Ingresos', mid, ts))
+            
+            if pv > pc:
+                ganancia_neta = (pv - pc) * cantidad
+                concepto_ganancia = f"Ganancia neta: {prod['nombre']} x{cantidad}"
+                rows.append((fecha, 'Ingreso', ganancia_neta, concepto_ganancia, 'Ganancias', mid, ts))
+        
+        elif tipo.lower() == 'entrada':
+            pc = prod['precio_compra'] or 0
+            if pc > 0:
+                monto_compra = pc * cantidad
+                concepto_compra = f"Compra: {prod['nombre']} x{cantidad} a ${pc:.2f} c/u"
+                rows.append((fecha, 'Egreso', monto_compra, concepto_compra, 'Compras', mid, ts))
+        return rows
+
+    def add_movimientos_bulk(self, items):
+        """Registra varios movimientos en una sola transacción.
+
+        items: lista de dicts con producto_id, tipo, cantidad y opcionalmente
+        comentario, usuario y fecha. Devuelve la cantidad de movimientos insertados.
+        """
+        if not items:
+            return 0
+        with self._lock, self.get_connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                # Con AUTOINCREMENT y el lock de escritura tomado, los ids nuevos son consecutivos
+                r = conn.execute("SELECT seq FROM sqlite_sequence WHERE name='movimientos'").fetchone()
+                next_id = (r['seq'] if r else 0) + 1
+
+                ts = now_iso()
+                mov_rows = []
+                for it in items:
+                    mov_rows.append((it.get('fecha') or ts, it['producto_id'], it['tipo'], it['cantidad'],
+                                     it.get('comentario', ''), it.get('usuario', 'Web'), ts))
+                conn.executemany('''
+                    INSERT INTO movimientos (fecha,producto_id,tipo,cantidad,comentario,usuario,creado_en)
+                    VALUES (?,?,?,?,?,?,?)
+                ''', mov_rows)
+
+                # Stock final por producto: (valor de ajuste o None, delta acumulado)
+                stock = {}
+                for it in items:
+                    base, delta = stock.get(it['producto_id'], (None, 0))
+                    tipo = it['tipo'].lower()
+                    if tipo == 'entrada':
+                        delta += it['cantidad']
+                    elif tipo == 'salida':
+                        delta -= it['cantidad']
+                    elif tipo == 'ajuste':
+                        base, delta = it['cantidad'], 0
+                    stock[it['producto_id']] = (base, delta)
+
+                ids = list(stock)
+                prods = {}
+                for i in range(0, len(ids), BULK_CHUNK):
+                    chunk = ids[i:i + BULK_CHUNK]
+                    marks = ','.join('?' * len(chunk))
+                    whens = ' '.join(['WHEN ? THEN COALESCE(?, stock_actual) + ?'] * len(chunk))
+                    params = []
+                    for pid in chunk:
+                        params.extend((pid, stock[pid][0], stock[pid][1]))
+                    params.extend(chunk)
+                    conn.execute(f'UPDATE productos SET stock_actual = CASE id {whens} END WHERE id IN ({marks})', params)
+                    for p in conn.execute(f'SELECT id, precio_venta, precio_compra, nombre FROM productos WHERE id IN ({marks})', chunk):
+                        prods[p['id']] = p
+
+                fin_rows = []
+                for mid, (mov, it) in enumerate(zip(mov_rows, items), start=next_id):
+                    prod = prods.get(it['producto_id'])
+                    if prod:
+                        fin_rows.extend(self._finanzas_de_movimiento(prod, it['tipo'], it['cantidad'], mov[0], mid, ts))
+                conn.executemany('''
+                    INSERT INTO finanzas (fecha,tipo,monto,concepto,categoria,movimiento_id,creado_en) 
+                    VALUES (?,?,?,?,?,?,?)
+                ''', fin_rows)
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+            conn.execute('COMMIT')
+            self._invalidar_productos()
+            return len(mov_rows)
+
+    def listar_movimientos(self, limit=None, before=None, before_id=None, tipo=None):
+        """Movimientos del más reciente al más antiguo.
+
+        before/before_id: fecha e id de la última fila de la página anterior (paginación por clave).
+        """
         with self.get_connection() as conn:
             c = conn.cursor()
             sql = '''SELECT m.*, p.nombre as producto_nombre, p.codigo as producto_codigo 
-                     FROM movimientos m LEFT JOIN productos p ON p.id=m.producto_id 
-                     ORDER BY m.fecha DESC'''
+                     FROM movimientos m LEFT JOIN productos p ON p.id=m.producto_id'''
+            where = []
+            params = []
+            if before and before_id:
+                where.append('(m.fecha, m.id) < (?, ?)')
+                params.extend((before, before_id))
+            elif before:
+                where.append('m.fecha < ?')
+                params.append(before)
+            if tipo:
+                where.append('m.tipo = ?')
+                params.append(tipo)
+            if where:
+                sql += ' WHERE ' + ' AND '.join(where)
+            sql += ' ORDER BY m.fecha DESC, m.id DESC'
             if limit:
-                sql += f' LIMIT {int(limit)}'
-            c.execute(sql)
+                sql += ' LIMIT ?'
+                params.append(int(limit))
+            c.execute(sql, params)
             return c.fetchall()
 
+    def resumen_movimientos_dia(self, dia=None):
+        """Cantidad de movimientos de cada tipo registrados en el día (hoy por defecto)"""
+        dia = dia or date.today()
+        desde = dia.isoformat()
+        hasta = (dia + timedelta(days=1)).isoformat()
+        with self.get_connection() as conn:
+            c = conn.cursor()
+            c.execute('SELECT tipo, COUNT(*) FROM movimientos WHERE fecha >= ? AND fecha < ? GROUP BY tipo',
+                      (desde, hasta))
+            resumen = {'Entrada': 0, 'Salida': 0, 'Ajuste': 0}
+            for tipo, n in c.fetchall():
+                resumen[tipo] = n
+            return resumen
+
+    def listar_movimientos_json(self, limit=200):
+        """Igual que listar_movimientos pero devuelve el arreglo JSON ya armado por SQLite"""
+        with self.get_connection() as conn:
+            c = conn.cursor()
+            c.execute('''
+                SELECT json_group_array(json_object(
+                    'id', m.id, 'fecha', m.fecha, 'producto_id', m.producto_id, 'tipo', m.tipo,
+                    'cantidad', m.cantidad, 'comentario', m.comentario, 'usuario', m.usuario,
+                    'creado_en', m.creado_en, 'producto_nombre', m.producto_nombre,
+                    'producto_codigo', m.producto_codigo
+                ))
+                FROM (SELECT m.*, p.nombre as producto_nombre, p.codigo as producto_codigo 
+                      FROM movimientos m LEFT JOIN productos p ON p.id=m.producto_id 
+                      ORDER BY m.fecha DESC, m.id DESC LIMIT ?) m
+            ''', (limit,))
+            return c.fetchone()[0]
+
     def add_finanza(self, tipo, monto, concepto, categoria=None, movimiento_id=None, fecha=None):
+        if not math.isfinite(monto):
+            raise ValueError('El monto debe ser un número válido')
+        ts = now_iso()
         if fecha is None:
-            fecha = now_iso()
+            fecha = ts
         with self.get_connection() as conn:
             cur = conn.execute('''
                 INSERT INTO finanzas (fecha,tipo,monto,concepto,categoria,movimiento_id,creado_en) 
                 VALUES (?,?,?,?,?,?,?)
-            ''', (fecha, tipo, monto, concepto, categoria, movimiento_id, now_iso()))
-            conn.commit()
+            ''', (fecha, tipo, monto, concepto, categoria, movimiento_id, ts))
             return cur.lastrowid
 
     def listar_finanzas(self, limit=None):
         with self.get_connection() as conn:
             c = conn.cursor()
             sql = 'SELECT * FROM finanzas ORDER BY fecha DESC'
+            params = ()
             if limit:
-                sql += f' LIMIT {int(limit)}'
-            c.execute(sql)
+                sql += ' LIMIT ?'
+                params = (int(limit),)
+            c.execute(sql, params)
             return c.fetchall()
 
     def delete_finanza(self, finanza_id):
         with self.get_connection() as conn:
             conn.execute('DELETE FROM finanzas WHERE id=?', (finanza_id,))
-            conn.commit()
 
     def balance_total(self):
         with self.get_connection() as conn:
             c = conn.cursor()
-            c.execute('''
-                SELECT 
-                    SUM(CASE WHEN tipo='Ingreso' AND categoria='Ingresos' THEN monto ELSE 0 END) as ingresos_brutos_ventas,
-                    SUM(CASE WHEN tipo='Ingreso' AND categoria='Ganancias' THEN monto ELSE 0 END) as ganancias_netas,
-                    SUM(CASE WHEN tipo='Ingreso' AND categoria NOT IN ('Ingresos', 'Ganancias') THEN monto ELSE 0 END) as otros_ingresos,
-                    SUM(CASE WHEN tipo='Egreso' THEN monto ELSE 0 END) as total_egresos
-                FROM finanzas
-            ''')
+            c.execute('SELECT ingresos_ventas, ganancias_netas, otros_ingresos, egresos FROM balance_cache WHERE id = 1')
             r = c.fetchone()
             
-            ingresos_ventas = r['ingresos_brutos_ventas'] or 0
+            ingresos_ventas = r['ingresos_ventas'] or 0
             ganancias_netas = r['ganancias_netas'] or 0
             otros_ingresos = r['otros_ingresos'] or 0
-            total_egresos = r['total_egresos'] or 0
+            total_egresos = r['egresos'] or 0
             
             ingresos_brutos = ingresos_ventas + otros_ingresos
             balance = ingresos_brutos - total_egresos
@@ -268,31 +598,65 @@ class DB:
             c.execute('SELECT * FROM productos WHERE stock_actual <= stock_minimo ORDER BY stock_actual')
             return c.fetchall()
 
+    def dashboard_data(self):
+        """Datos del dashboard con una sola toma de la conexión"""
+        with self.get_connection() as conn:
+            c = conn.cursor()
+            c.execute('SELECT COUNT(*) FROM productos WHERE stock_actual <= stock_minimo')
+            productos_bajo = c.fetchone()[0]
+            return {
+                'balance': self.balance_total(),
+                'productos_bajo': productos_bajo,
+                'movimientos': self.listar_movimientos(limit=5)
+            }
+
 # Instanciar base de datos
 db = DB()
 
+@lru_cache(maxsize=2)
+def product_options_html(version, periodo):
+    """<option> de productos para el formulario de movimientos, renderizados una vez por versión.
+
+    periodo cambia cada PRODUCTOS_CACHE_TTL segundos para ver también lo que escriben otros procesos.
+    """
+    return render_template('producto_options.html', productos=db.listar_productos(cache=False))
+
 # --------------------
 # RUTAS WEB
 # --------------------
 
+def limite_pagina(default=PAGINA):
+    """?limit= acotado entre 1 y PAGINA_MAX"""
+    limit = request.args.get('limit', default, type=int)
+    return max(1, min(limit, PAGINA_MAX))
+
 @app.route('/')
 def index():
     """Dashboard principal"""
-    balance_data = db.balance_total()
-    productos_bajo = db.stock_bajo()
-    movimientos_recientes = db.listar_movimientos(limit=5)
+    data = db.dashboard_data()
     
     return render_template('dashboard.html', 
-                         balance=balance_data,
-                         productos_bajo=len(productos_bajo),
-                         movimientos=movimientos_recientes)
+                         balance=data['balance'],
+                         productos_bajo=data['productos_bajo'],
+                         movimientos=data['movimientos'])
 
 @app.route('/productos')
 def productos():
     """Lista de productos"""
     search = request.args.get('search', '')
-    productos_list = db.listar_productos(search=search if search else None)
-    return render_template('productos.html', productos=productos_list, search=search)
+    limit = limite_pagina()
+    after_nombre = request.args.get('after')
+    after_id = request.args.get('after_id', type=int)
+    after = (after_nombre, after_id) if after_nombre is not None and after_id else None
+    productos_list = db.listar_productos(search=search if search else None, after=after, limit=limit)
+    resumen = db.resumen_productos(search=search if search else None)
+    siguiente = None
+    if len(productos_list) == limit:
+        ultimo = productos_list[-1]
+        siguiente = url_for('productos', search=search or None, limit=limit,
+                            after=ultimo['nombre'], after_id=ultimo['id'])
+    return render_template('productos.html', productos=productos_list, search=search,
+                           resumen=resumen, siguiente=siguiente)
 
 @app.route('/productos/nuevo', methods=['GET', 'POST'])
 def nuevo_producto():
@@ -361,27 +725,21 @@ def eliminar_producto(producto_id):
 @app.route('/movimientos')
 def movimientos():
     """Lista de movimientos"""
-    movimientos_raw = db.listar_movimientos(limit=200)
-    # Convertir Row objects a diccionarios
-    movimientos_list = []
-    for mov in movimientos_raw:
-        movimientos_list.append({
-            'id': mov['id'],
-            'fecha': mov['fecha'],
-            'tipo': mov['tipo'],
-            'cantidad': mov['cantidad'],
-            'producto_nombre': mov['producto_nombre'],
-            'producto_codigo': mov['producto_codigo'],
-            'comentario': mov['comentario'],
-            'usuario': mov['usuario']
-        })
-    return render_template('movimientos.html', movimientos=movimientos_list)
+    limit = limite_pagina()
+    before = request.args.get('before')
+    before_id = request.args.get('before_id', type=int)
+    tipo = request.args.get('tipo') or None
+    movimientos_list = db.listar_movimientos(limit=limit, before=before, before_id=before_id, tipo=tipo)
+    siguiente = None
+    if len(movimientos_list) == limit:
+        ultimo = movimientos_list[-1]
+        siguiente = url_for('movimientos', tipo=tipo, limit=limit, before=ultimo['fecha'], before_id=ultimo['id'])
+    return render_template('movimientos.html', movimientos=movimientos_list, tipo=tipo,
+                           resumen=db.resumen_movimientos_dia(), siguiente=siguiente)
 
 @app.route('/movimientos/nuevo', methods=['GET', 'POST'])
 def nuevo_movimiento():
     """Agregar nuevo movimiento"""
-    productos_list = db.listar_productos()
-    
     if request.method == 'POST':
         try:
             producto_id = int(request.form.get('producto_id'))
@@ -396,7 +754,40 @@ def nuevo_movimiento():
         except Exception as e:
             flash(f'Error: {str(e)}', 'error')
     
-    return render_template('movimiento_form.html', productos=productos_list)
+    options_html = product_options_html(db.productos_version, int(time.monotonic() // PRODUCTOS_CACHE_TTL))
+    return render_template('movimiento_form.html', options_html=options_html)
+
+@app.route('/movimientos/bulk', methods=['POST'])
+def movimientos_bulk():
+    """Registrar varios movimientos en una sola transacción (JSON)"""
+    data = request.get_json(silent=True)
+    if not isinstance(data, list):
+        return jsonify({'error': 'Se esperaba una lista de movimientos'}), 400
+    items = []
+    for i, d in enumerate(data):
+        try:
+            tipo = TIPOS_MOVIMIENTO.get(str(d['tipo']).strip().lower())
+            cantidad = float(d['cantidad'])
+            item = {
+                'producto_id': int(d['producto_id']),
+                'tipo': tipo,
+                'cantidad': cantidad,
+                'comentario': d.get('comentario', ''),
+                'usuario': d.get('usuario', 'Web'),
+                'fecha': d.get('fecha')
+            }
+        except (KeyError, TypeError, ValueError, AttributeError) as e:
+            return jsonify({'error': f'Movimiento {i}: dato inválido ({e})'}), 400
+        if tipo is None:
+            return jsonify({'error': f'Movimiento {i}: tipo debe ser Entrada, Salida o Ajuste'}), 400
+        if not math.isfinite(cantidad):
+            return jsonify({'error': f'Movimiento {i}: cantidad inválida'}), 400
+        items.append(item)
+    try:
+        insertados = db.add_movimientos_bulk(items)
+    except sqlite3.Error as e:
+        return jsonify({'error': f'Error de base de datos: {e}'}), 500
+    return jsonify({'insertados': insertados})
 
 @app.route('/finanzas')
 def finanzas():
@@ -414,6 +805,8 @@ def nueva_finanza():
             monto = float(request.form.get('monto'))
             concepto = request.form.get('concepto')
             categoria = request.form.get('categoria', 'Otros')
+            if not math.isfinite(monto):
+                raise ValueError('El monto debe ser un número válido')
             
             db.add_finanza(tipo, monto, concepto, categoria)
             flash('Finanza registrada exitosamente', 'success')
@@ -439,6 +832,12 @@ def reportes():
     stock_bajo = db.stock_bajo()
     return render_template('reportes.html', productos_bajo=stock_bajo)
 
+@app.route('/api/movimientos')
+def api_movimientos():
+    """API con los últimos movimientos en JSON"""
+    limit = limite_pagina(default=PAGINA_MAX)
+    return Response(db.listar_movimientos_json(limit), mimetype='application/json')
+
 @app.route('/api/calcular_precio')
 def api_calcular_precio():
     """API para calcular precios automáticamente"""
@@ -460,11 +859,13 @@ def api_calcular_precio():
 @app.route('/manifest.json')
 def manifest():
     """Servir manifest.json para PWA"""
-    return send_file('static/manifest.json', mimetype='application/manifest+json')
+    return send_from_directory(app.static_folder, 'manifest.json', max_age=PWA_MAX_AGE,
+                               mimetype='application/manifest+json')
 
 @app.route('/sw.js')
 def service_worker():
-    """Servir service worker"""
-    return send_file('static/sw.js', mimetype='application/javascript')
+    """Servir service worker (en la raíz para que su alcance sea todo el sitio)"""
+    return send_from_directory(app.static_folder, 'sw.js', max_age=PWA_MAX_AGE,
+                               mimetype='application/javascript')
 if __name__ == '__main__':
     app.run(debug=False)  # debug=False en producción
\ No newline at end of file